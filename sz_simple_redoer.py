@@ -3,12 +3,16 @@
 import concurrent.futures
 
 import argparse
+import array
 import orjson
 import logging
+import re
 import traceback
 
 import importlib
+import queue
 import sys
+import threading
 import os
 import time
 import random
@@ -23,14 +27,45 @@ from senzing import (
 )
 
 INTERVAL = 1000
-LONG_RECORD = os.getenv("LONG_RECORD", default=300)
+LONG_RECORD = int(os.getenv("LONG_RECORD", default=300))
 EMPTY_PAUSE_TIME = int(os.getenv("SENZING_REDO_SLEEP_TIME_IN_SECONDS", default=60))
 
-TUPLE_MSG = 0
-TUPLE_STARTTIME = 1
+# timers run on time.monotonic_ns() so the hot comparisons stay integer
+NS_PER_SEC = 1_000_000_000
+LONG_RECORD_NS = LONG_RECORD * NS_PER_SEC
+
+BUF_SIZE = 4096
+BUFS_PER_WORKER = 2
+
+# pooled response buffers so the hot loop doesn't allocate a fresh
+# bytearray per engine call
+buf_pool = queue.SimpleQueue()
+
+def get_buf():
+    try:
+        buf = buf_pool.get_nowait()
+    except queue.Empty:
+        return bytearray()
+    buf.clear()  # the engine bindings append, so hand out empty buffers
+    return buf
+
+def put_buf(buf):
+    buf.clear()
+    buf_pool.put(buf)
+
+def prime_buf_pool(count):
+    for _ in range(count):
+        buf_pool.put(bytearray())
 
 log_format = "%(asctime)s %(message)s"
 
+# pre-bound error logger for the per-record failure paths; lazy
+# %-formatting keeps the message cheap unless a handler emits it
+err_log = logging.getLogger("sz_redo").error
+
+DS_RE = re.compile(rb'"DATA_SOURCE"\s*:\s*"([^"]+)"')
+RID_RE = re.compile(rb'"RECORD_ID"\s*:\s*"([^"]+)"')
+
 def loggingID(rec):
     dsrc = rec.get("DATA_SOURCE")
     rec_id = rec.get("RECORD_ID")
@@ -41,21 +76,67 @@ def loggingID(rec):
         return f'{umf_proc[PARAMS][0][PARAM][VALUE]} : REPAIR_ENTITY'
     return "UNKNOWN RECORD"
 
-def process_msg(engine, msg, info):
+def loggingID_fast(raw):
+    # pull just DATA_SOURCE/RECORD_ID without parsing the whole record
+    dsrc = DS_RE.search(raw)
+    rec_id = RID_RE.search(raw)
+    if dsrc and rec_id:
+        return f'{dsrc.group(1).decode()} : {rec_id.group(1).decode()}'
+    return loggingID(orjson.loads(raw))
+
+# two specialized workers instead of one branching on --info per record;
+# engine_call is the matching bound G2Engine method, resolved once at
+# startup so the hot path skips the attribute lookup and goes straight
+# into the C binding, which releases the GIL
+
+def process_msg_with_info(engine_call, msg):
     try:
-        if info:
-            response = bytearray()
-            engine.processWithInfo(msg, response)
+        response = get_buf()
+        try:
+            engine_call(msg, response)
             return response.decode()
-        else:
-            engine.process(msg)
-            return None
+        finally:
+            put_buf(response)
     except Exception as err:
-        print(f"{err} [{msg}]", file=sys.stderr)
+        # one atomic write(2): no stderr/logging lock to serialize the
+        # worker threads on during an error storm
+        os.write(2, f"{err} [len={len(msg)}]\n".encode())
         raise
 
+def process_msg_no_info(engine_call, msg):
+    try:
+        engine_call(msg)
+        return None
+    except Exception as err:
+        os.write(2, f"{err} [len={len(msg)}]\n".encode())
+        raise
 
-try:
+def redo_fetcher(engine, prefetch_q):
+    # dedicated producer: keeps the bounded prefetch queue stocked so
+    # submission never waits on an engine round trip; the queue bound
+    # provides the backpressure when the workers fall behind
+    response = bytearray(BUF_SIZE)
+    while True:
+        try:
+            response.clear()
+            engine.getRedoRecord(response)
+            if not response:
+                print(
+                    f"No redo records available. Pausing for {EMPTY_PAUSE_TIME} seconds."
+                )
+                time.sleep(EMPTY_PAUSE_TIME)
+                continue
+            # keep the payload as bytes; the engine bindings take bytes
+            # directly, so no decode per record
+            prefetch_q.put(bytes(response))
+        except Exception as err:
+            err_log("%s: %s", type(err).__name__, err)
+            # hand the failure to the main loop, which re-raises it
+            prefetch_q.put(err)
+            return
+
+
+def main():
     log_level_map = {
         "notset": logging.NOTSET,
         "debug": logging.DEBUG,
@@ -104,7 +185,7 @@ try:
     # Initialize the G2Engine
     g2 = G2Engine()
     g2.init("sz_simple_redoer", engine_config, args.debugTrace)
-    logCheckTime = prevTime = time.time()
+    logCheckTime = prevTime = time.monotonic_ns()
 
     senzing_governor = importlib.import_module("senzing_governor")
     governor = senzing_governor.Governor(hint="sz_simple_redoer")
@@ -117,114 +198,193 @@ try:
     messages = 0
 
     with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
-        print(f"Threads: {executor._max_workers}")
-        futures = {}
-        empty_pause = 0
+        # resolve the worker count once; the executor already turned a
+        # None max_workers into its default
+        n_slots = executor._max_workers
+        print(f"Threads: {n_slots}")
+        prime_buf_pool(n_slots * BUFS_PER_WORKER)
+
+        # in-flight work as parallel slot arrays rather than a dict of
+        # futures: start times live in one contiguous int array so the
+        # long-record scan doesn't chase a tuple per entry
+        pending_start = array.array("q", [0] * n_slots)
+        pending_msg = [None] * n_slots
+        slot_futures = [None] * n_slots
+        free_slots = list(range(n_slots))
+
+        # workers push their finished future here via add_done_callback,
+        # so the main loop wakes on exactly the futures that completed
+        completed_q = queue.SimpleQueue()
+
+        # redo records are fetched by a dedicated producer thread into a
+        # bounded queue the submit loop drains
+        prefetch_q = queue.Queue(maxsize=n_slots * BUFS_PER_WORKER)
+        fetcher = threading.Thread(
+            target=redo_fetcher, args=(g2, prefetch_q), daemon=True
+        )
+        fetcher.start()
+
+        if args.info:
+            engine_call = g2.processWithInfo
+            worker = process_msg_with_info
+        else:
+            engine_call = g2.process
+            worker = process_msg_no_info
+
+        # bind names used once-per-record ahead of the loop so the hot
+        # path hits locals instead of globals/attribute lookups
+        _ExceptionCode = ExceptionCode
+        _submit = executor.submit
+        _worker = worker
+        _now_ns = time.monotonic_ns
+        _interval = INTERVAL
+        _long_record_ns = LONG_RECORD_NS
+
+        to_next_report = _interval
         try:
             while True:
 
-                nowTime = time.time()
-                if futures:
-                    done, _ = concurrent.futures.wait(
-                        futures,
-                        timeout=10,
-                        return_when=concurrent.futures.FIRST_COMPLETED,
-                    )
+                nowTime = _now_ns()
 
-                    delete_batch = []
-                    delete_cnt = 0
-
-                    for fut in done:
-                        msg = futures.pop(fut)
-                        try:
-                            result = fut.result()
-                            if result:
-                                print(
-                                    result
-                                )  # we would handle pushing to withinfo queues here BUT that is likely a second future task/executor
-                        except G2BadInputException as err:
-                            if (
-                                ExceptionCode(err) == 7426
-                            ):  # log transliteration issue specially
-                                print(f"Transliteration failure: {msg[TUPLE_MSG]}")
-                            pass
-                        except G2RetryTimeoutExceededException as err:
-                            print("Hit retry timeout")
-
-                        messages += 1
-
-                        if messages % INTERVAL == 0:  # display rate stats
-                            diff = nowTime - prevTime
-                            speed = -1
-                            if diff > 0.0:
-                                speed = int(INTERVAL / diff)
+                # drain finished work; block only while every slot is
+                # busy so free slots head straight to the refill below
+                done = []
+                if not free_slots:
+                    try:
+                        done.append(completed_q.get(timeout=10))
+                    except queue.Empty:
+                        pass
+                while True:
+                    try:
+                        done.append(completed_q.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for fut in done:
+                    slot = fut._slot
+                    msg = pending_msg[slot]
+                    pending_msg[slot] = None
+                    slot_futures[slot] = None
+                    free_slots.append(slot)
+                    try:
+                        result = fut.result()
+                        if result:
                             print(
-                                f"Processed {messages} redo, {speed} records per second"
+                                result
+                            )  # we would handle pushing to withinfo queues here BUT that is likely a second future task/executor
+                    except G2BadInputException as err:
+                        if (
+                            _ExceptionCode(err) == 7426
+                        ):  # log transliteration issue specially
+                            err_log(
+                                "Transliteration failure: %s",
+                                msg.decode(errors="replace"),
                             )
-                            prevTime = nowTime
-
-                    if nowTime > logCheckTime + (
-                        LONG_RECORD / 2
-                    ):  # log long running records
-                        logCheckTime = nowTime
-
-                        response = bytearray()
-                        g2.stats(response)
-                        print(f"\n{response.decode()}\n")
-
-                        numStuck = 0
-                        numRejected = 0
-                        for fut, msg in futures.items():
-                            if not fut.done():
-                                duration = nowTime - msg[TUPLE_STARTTIME]
-                                if duration > LONG_RECORD * 2:
-                                    numStuck += 1
-                                    record = orjson.loads(msg[TUPLE_MSG])
-                                    print(
-                                        f'Long record ({duration/60:.1f} min): {loggingID(record)}'
-                                    )
-                            if numStuck >= executor._max_workers:
-                                print(
-                                    f"All {executor._max_workers} threads are stuck on long running records"
-                                )
+                        pass
+                    except G2RetryTimeoutExceededException as err:
+                        print("Hit retry timeout")
+
+                    messages += 1
+                    to_next_report -= 1
+
+                    if not to_next_report:  # display rate stats
+                        to_next_report = _interval
+                        diff = nowTime - prevTime
+                        speed = -1
+                        if diff > 0:
+                            speed = _interval * NS_PER_SEC // diff
+                        print(
+                            f"Processed {messages} redo, {speed} records per second"
+                        )
+                        prevTime = nowTime
+
+                if nowTime > logCheckTime + (
+                    _long_record_ns // 2
+                ):  # log long running records
+                    logCheckTime = nowTime
+
+                    response = bytearray()
+                    g2.stats(response)
+                    print(f"\n{response.decode()}\n")
+
+                    numStuck = 0
+                    numRejected = 0
+                    # occupied slots are in flight by construction
+                    # (completions free their slot before we get here),
+                    # so no need to take each future's lock via done()
+                    for slot, fut in enumerate(slot_futures):
+                        if fut is None:
+                            continue
+                        duration = nowTime - pending_start[slot]
+                        if duration > _long_record_ns * 2:
+                            numStuck += 1
+                            print(
+                                f'Long record ({duration / (60 * NS_PER_SEC):.1f} min): {loggingID_fast(pending_msg[slot])}'
+                            )
+                        if numStuck >= n_slots:
+                            print(
+                                f"All {n_slots} threads are stuck on long running records"
+                            )
+                            break
 
                 pauseSeconds = governor.govern()
                 # either governor fully triggered or our executor is full
                 # not going to get more messages
                 if pauseSeconds < 0.0:
-                    time.sleep(1)
+                    # park on the completion queue instead of sleep-polling;
+                    # requeue anything received so the top of the loop
+                    # handles it, and re-govern within a second
+                    try:
+                        completed_q.put(completed_q.get(timeout=1.0))
+                    except queue.Empty:
+                        pass
                     continue
-                if len(futures) >= executor._max_workers:
-                    time.sleep(1)
+                if not free_slots:
+                    # the top of the loop blocks on the completion queue,
+                    # so a freed slot wakes us immediately
                     continue
                 if pauseSeconds > 0.0:
                     time.sleep(pauseSeconds)
 
-                if empty_pause:
-                    if time.time() < empty_pause:
-                        time.sleep(1)
-                        continue
-                    empty_pause = 0
-
-                while len(futures) < executor._max_workers:
-                    try:
-                        response = bytearray()
-                        g2.getRedoRecord(response)
-                        # print(response)
-                        if not response:
-                            print(
-                                f"No redo records available. Pausing for {EMPTY_PAUSE_TIME} seconds."
-                            )
-                            empty_pause = time.time() + EMPTY_PAUSE_TIME
-                            break
-                        msg = response.decode()
-                        futures[executor.submit(process_msg, g2, msg, args.info)] = (
-                            msg,
-                            time.time(),
-                        )
-                    except Exception as err:
-                        print(f"{type(err).__name__}: {err}", file=sys.stderr)
-                        raise
+                # one exception-handler setup per slot-fill batch
+                # instead of per record; the handler only logs and
+                # re-raises, which exits the loop either way
+                try:
+                    while free_slots:
+                        if len(free_slots) == n_slots:
+                            # nothing in flight: wait on the fetcher
+                            # rather than spinning through the loop
+                            try:
+                                msg = prefetch_q.get(timeout=10)
+                            except queue.Empty:
+                                break
+                        else:
+                            try:
+                                msg = prefetch_q.get_nowait()
+                            except queue.Empty:
+                                # fetcher is behind the workers: park on
+                                # the completion queue (requeueing for the
+                                # top-of-loop handler) instead of spinning
+                                # through the governor at full speed
+                                try:
+                                    completed_q.put(
+                                        completed_q.get(timeout=1.0)
+                                    )
+                                except queue.Empty:
+                                    pass
+                                break
+                        if isinstance(msg, Exception):
+                            raise msg  # fetcher died; shut down
+                        slot = free_slots.pop()
+                        pending_start[slot] = _now_ns()
+                        pending_msg[slot] = msg
+                        fut = _submit(_worker, engine_call, msg)
+                        fut._slot = slot
+                        slot_futures[slot] = fut
+                        fut.add_done_callback(completed_q.put)
+                except Exception as err:
+                    err_log("%s: %s", type(err).__name__, err)
+                    raise
 
             print(f"Processed total of {messages} redo")
 
@@ -234,18 +394,20 @@ try:
                 file=sys.stderr,
             )
             traceback.print_exc()
-            nowTime = time.time()
-            for fut, msg in futures.items():
-                if not fut.done():
-                    duration = nowTime - msg[TUPLE_STARTTIME]
-                    record = orjson.loads(msg[TUPLE_MSG])
+            nowTime = time.monotonic_ns()
+            for slot, fut in enumerate(slot_futures):
+                if fut is not None and not fut.done():
+                    duration = nowTime - pending_start[slot]
                     print(
-                        f'Still processing ({duration/60:.1f} min: {loggingID(record)}'
+                        f'Still processing ({duration / (60 * NS_PER_SEC):.1f} min: {loggingID_fast(pending_msg[slot])}'
                     )
             executor.shutdown()
             exit(-1)
 
-except Exception as err:
-    print(err, file=sys.stderr)
-    traceback.print_exc()
-    exit(-1)
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as err:
+        print(err, file=sys.stderr)
+        traceback.print_exc()
+        exit(-1)